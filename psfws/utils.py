@@ -2,9 +2,10 @@
 
 import numpy as np
 import pandas as pd
-from scipy.interpolate import UnivariateSpline, make_interp_spline
-from scipy.integrate import trapz
+from scipy.interpolate import UnivariateSpline, CubicSpline
 import scipy.stats
+import functools
+import math
 import os
 
 def get_data_path():
@@ -16,15 +17,18 @@ def get_data_path():
 
 def convert_to_galsim(params, alt, az, lat=-30.2446, lon=-70.7494):
     """Convert parameter vector params to coordinates used by GalSim."""
+    # layer parameters as float arrays, so all operations below are on arrays
+    for k in ['v', 'u', 'h', 'edges', 'j']:
+        params[k] = np.ascontiguousarray(params[k], dtype=np.float64)
+
     # rotate wind vector:
     obs_nez, sky_nez = get_both_nez(alt, az, lat, lon)
     
-    sky_v, sky_u = [], []
-    for v,u in zip(params['v'], params['u']):
-        obs_wind = v * obs_nez[0] + u * obs_nez[1]
-        sky_wind = np.dot(sky_nez, obs_wind)
-        sky_v.append(sky_wind[0])
-        sky_u.append(sky_wind[1])
+    # wind vectors of all layers in observatory frame, one per row
+    obs_wind = (np.outer(params['v'], obs_nez[0]) +
+                np.outer(params['u'], obs_nez[1]))
+    sky_wind = obs_wind @ sky_nez.T
+    sky_v, sky_u = sky_wind[:, 0], sky_wind[:, 1]
 
     # modify params: 
     params['v'], params['u'] = sky_v, sky_u
@@ -33,25 +37,31 @@ def convert_to_galsim(params, alt, az, lat=-30.2446, lon=-70.7494):
 
     # use zenith angle to modify altitudes to LOS distances
     sec_zenith = 1 / np.cos(np.radians(90 - alt))
-    params['h'] = [h * sec_zenith for h in params['h']]
-    params['edges'] = [h * sec_zenith for h in params['edges']]
+    params['h'] = params['h'] * sec_zenith
+    params['edges'] = params['edges'] * sec_zenith
 
     # use zenith angle to modify turbulence parameters
-    params['j'] = [j * sec_zenith for j in params['j']]
+    params['j'] = params['j'] * sec_zenith
     return params
 
 
+@functools.lru_cache(maxsize=8)
 def get_obs_nez(lat,lon):
-    """Get North, East, and zenith unit vectors for observatory at Earth lat,lon."""
-    north = np.array([-np.cos(lon)*np.sin(lat),
-                      -np.sin(lon)*np.sin(lat),
-                      np.cos(lat)])
-    zenith = np.array([np.cos(lon)*np.cos(lat),
-                       np.sin(lon)*np.cos(lat),
-                       np.sin(lat)])
-    east = np.cross(north, zenith)
+    """Get North, East, and zenith unit vectors for observatory at Earth lat,lon.
+
+    Results are cached, so the returned array is read-only.
+    """
+    north = np.array([-math.cos(lon)*math.sin(lat),
+                      -math.sin(lon)*math.sin(lat),
+                      math.cos(lat)])
+    zenith = np.array([math.cos(lon)*math.cos(lat),
+                       math.sin(lon)*math.cos(lat),
+                       math.sin(lat)])
+    east = _cross(north, zenith)
     # unit vectors along _rows_
-    return np.array([north, east, zenith])
+    nez = np.array([north, east, zenith])
+    nez.flags.writeable = False
+    return nez
 
 def get_both_nez(alt, az, lat, lon):
     """Get N, E, zenith unit vectors for observing position alt,az from lat,lon.
@@ -61,27 +71,35 @@ def get_both_nez(alt, az, lat, lon):
     - alt = 0 means horizon, 90 means zenith
     """
     # convert everything to radians
-    lat = np.deg2rad(lat)
-    lon = np.deg2rad(lon)
-    alt = np.deg2rad(alt)
-    az = np.deg2rad(az)
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    alt = math.radians(alt)
+    az = math.radians(az)
     
     # compute n/e/z vectors of observatory
     N, E, Z = get_obs_nez(lat,lon)
 
     # find compass direction the telescope points to
-    compass_dir = N * np.cos(az) + E * np.sin(az)
+    compass_dir = N * math.cos(az) + E * math.sin(az)
     # lift this from horizon by altitude angle
-    boresight = Z * np.sin(alt) + compass_dir * np.cos(alt)
+    boresight = Z * math.sin(alt) + compass_dir * math.cos(alt)
 
     # in our coordinates, (0,0,1) points to the north celestial pole (ncp)
     ncp = np.array([0,0,1])
-    east = np.cross(ncp, boresight)
-    east /= np.sqrt(np.dot(east, east))  # normalized
-    north = np.cross(boresight, east)
+    east = _cross(ncp, boresight)
+    east /= math.sqrt(np.dot(east, east))  # normalized
+    north = _cross(boresight, east)
 
     return np.array([N,E,Z]), np.array([north, east, boresight])
 
+
+def _cross(a, b):
+    """Return cross product of 3-vectors a and b, without np.cross overhead."""
+    return np.array([a[1]*b[2] - a[2]*b[1],
+                     a[2]*b[0] - a[0]*b[2],
+                     a[0]*b[1] - a[1]*b[0]])
+
+
 def lognorm(sigma, scale):
     """Return a scipy stats lognorm defined by parameters sigma and scale.
 
@@ -109,24 +127,48 @@ def correlate_marginals(X, y, rho, rng):
 
     """
     X.sort_values(by=['speed'], inplace=True)
-    y_srtd = np.sort(y)
+    x = X['speed'].to_numpy(dtype=np.float64)
+    y_srtd = np.sort(np.asarray(y, dtype=np.float64))
 
     # 15 is ad hoc; seems to work to ensure loops through x at least once
     swp_window = (y_srtd[-1]-y_srtd[0]) / 15
     N = len(y)
 
+    # means and variances are unchanged by swapping entries of y, so only the
+    # numerator of the correlation coefficient changes. Centering x avoids
+    # cancellation between sum(x*y) and N*mean(x)*mean(y).
+    x_c = x - x.mean()
+    y_c = y_srtd - y_srtd.mean()
+    denom = np.sqrt(np.dot(x_c, x_c) * np.dot(y_c, y_c))
+    numer = np.dot(x_c, y_c)
+
+    # swaps shuffle y_srtd, so keep the sorted values aside to search the swap
+    # window in, and track where each of them currently is: the value of rank
+    # r is at y_srtd[pos[r]], and rank[pos[r]] == r
+    y_vals = y_srtd.copy()
+    pos = np.arange(N)
+    rank = np.arange(N)
+
     # loop a hundred times over the dataset
     for i in range(100 * N):
         # index of the first pair in a swap
         i_first = i % N
         # find list of points within the swap_window of this first point
-        valid_indices, = np.where(abs(y_srtd - y_srtd[i_first]) < swp_window)
+        lo = np.searchsorted(y_vals, y_srtd[i_first] - swp_window, 'right')
+        hi = np.searchsorted(y_vals, y_srtd[i_first] + swp_window, 'left')
+        # sorting the k = hi - lo candidates, O(k log k), is only needed so a
+        # seeded rng draws the same swaps as the previous full scan did
+        valid_indices = np.sort(pos[lo:hi])
         # randomly choose one of these as the swap pair
-        i_swp = rng.choice(valid_indices.flatten())
+        i_swp = valid_indices[rng.integers(len(valid_indices))]
         # swap entries
+        numer += (x_c[i_first] - x_c[i_swp]) * (y_srtd[i_swp] - y_srtd[i_first])
         y_srtd[i_first], y_srtd[i_swp] = y_srtd[i_swp], y_srtd[i_first]
+        r_first, r_swp = rank[i_first], rank[i_swp]
+        rank[i_first], rank[i_swp] = r_swp, r_first
+        pos[r_first], pos[r_swp] = i_swp, i_first
 
-        if np.corrcoef(X['speed'], y_srtd)[0][1] <= rho:
+        if numer / denom <= rho:
             # add y to the dataframe X as a new column
             try:
                 X.insert(loc=2, column='j_gl', value=y_srtd)
@@ -155,25 +197,33 @@ def process_telemetry(telemetry):
     tel_temp = telemetry['temperature']
 
     # find masks for telemetry values that are zero or, for speeds, >40
-    speed_mask = tel_speed.index[tel_speed.apply(lambda x: x != 0 and x < 40)]
-    dir_mask = tel_dir.index[tel_dir.apply(lambda x: x != 0)]
-    temp_mask = tel_temp.index[tel_temp.apply(lambda x: x != 0)]
+    speed_mask = (tel_speed != 0) & (tel_speed < 40)
+    dir_mask = tel_dir != 0
+    temp_mask = tel_temp != 0
+
+    # convert temperatures to Kelvin from degrees Celsius, in place on the
+    # (already copied) masked values
+    temp_k = tel_temp.to_numpy(dtype=np.float64)[temp_mask.to_numpy()]
+    temp_k += 273.15
 
-    # return, converting temperatures to Kelvin from degrees Celsius
-    return {'phi': tel_dir.loc[dir_mask],
-            'speed': tel_speed.loc[speed_mask],
-            't': tel_temp.loc[temp_mask] + 273.15}
+    return {'phi': tel_dir[dir_mask],
+            'speed': tel_speed[speed_mask],
+            't': pd.Series(temp_k, index=tel_temp.index[temp_mask])}
 
 
-def to_direction(u, v):
+def to_direction(u, v, out=None):
     """Return wind direction, in degrees, from u,v components of velocity.
 
-    (u,v) are components of wind speed toward east, north respectively.
+    (u,v) are components of wind speed toward east, north respectively. If
+    given, the array ``out`` is filled with the result and returned.
     """
-    # d is angle east of north
-    d = np.arctan2(u, v) * (180/np.pi)
+    # d is angle east of north; operations below are in place on this array
+    d = np.arctan2(u, v, out=out)
+    d *= 180/np.pi
     # convention is direction wind comes *from* rather than blows *to*: add 180.
-    return (d + 180) % 360
+    d += 180
+    d %= 360
+    return d
 
 
 def process_forecast(df):
@@ -187,23 +237,24 @@ def process_forecast(df):
     - reverse u, v, and t altitudes
     - filter daytime datapoints
     - add "speed" and "phi" columns
+
+    All profiles must have the same number of altitudes.
     """
+    # select night time forecasts, dropping pressures which aren't needed
     not_daytime = df.index.hour != 12
-    df = df.iloc[not_daytime].copy()
-    n = len(df)
-
-    # reverse
-    for k in ['u', 'v', 't']:
-        df[k] = [df[k].values[i][::-1] for i in range(n)]
+    df = df.loc[not_daytime, df.columns.drop('p', errors='ignore')]
 
-    df['speed'] = [np.hypot(df['u'].values[i], df['v'].values[i])
-                   for i in range(n)]
+    if len(df) == 0:
+        # nothing to stack
+        df['speed'], df['phi'] = [], []
+        return df
 
-    df['phi'] = [to_direction(df['u'].values[i], df['v'].values[i])
-                 for i in range(n)]
+    # stack profiles into 2D arrays, one row per forecast, and reverse
+    u, v, t = [np.stack(df[k].to_numpy())[:, ::-1] for k in ['u', 'v', 't']]
 
-    if 'p' in df.columns:
-        df.drop('p', axis=1, inplace=True)
+    df['u'], df['v'], df['t'] = list(u), list(v), list(t)
+    df['speed'] = list(np.hypot(u, v))
+    df['phi'] = list(to_direction(u, v))
 
     return df
 
@@ -227,32 +278,25 @@ def match_telemetry(telemetry, forecast_dates):
         subselection of input dates which had a valid overlap.
 
     """
-    n = len(forecast_dates)
-
-    speed = telemetry['speed']
-    direction = telemetry['phi']
-    temp = telemetry['t']
-
-    speed_ids = [speed.index[abs(forecast_dates[i] - speed.index)
-                             < pd.Timedelta('30min')] for i in range(n)]
-
-    dir_ids = [direction.index[abs(forecast_dates[i] - direction.index)
-                               < pd.Timedelta('30min')] for i in range(n)]
-
-    temp_ids = [temp.index[abs(forecast_dates[i] - temp.index)
-                           < pd.Timedelta('30min')] for i in range(n)]
-
-    ids_to_keep = [i for i in range(n)
-                   if len(speed_ids[i]) != 0
-                   and len(dir_ids[i]) != 0
-                   and len(temp_ids[i]) != 0]
-
-    matched_s = [np.median(speed.loc[speed_ids[i]])
-                 for i in range(n) if i in ids_to_keep]
-    matched_d = [np.median(direction.loc[dir_ids[i]])
-                 for i in range(n) if i in ids_to_keep]
-    matched_t = [np.median(temp.loc[temp_ids[i]])
-                 for i in range(n) if i in ids_to_keep]
+    # sort by time, so the samples near each forecast are a contiguous slice
+    speed = telemetry['speed'].sort_index()
+    direction = telemetry['phi'].sort_index()
+    temp = telemetry['t'].sort_index()
+
+    speed_l, speed_r = _window_bounds(speed.index, forecast_dates)
+    dir_l, dir_r = _window_bounds(direction.index, forecast_dates)
+    temp_l, temp_r = _window_bounds(temp.index, forecast_dates)
+
+    ids_to_keep = np.flatnonzero((speed_r > speed_l) &
+                                 (dir_r > dir_l) &
+                                 (temp_r > temp_l))
+
+    matched_s = _window_medians(speed, speed_l[ids_to_keep],
+                                speed_r[ids_to_keep])
+    matched_d = _window_medians(direction, dir_l[ids_to_keep],
+                                dir_r[ids_to_keep])
+    matched_t = _window_medians(temp, temp_l[ids_to_keep],
+                                temp_r[ids_to_keep])
 
     # calculate velocity componenents from the matched speed/directions    
     v = np.array(matched_s) * np.cos((np.array(matched_d) - 180) * np.pi/180)
@@ -263,6 +307,38 @@ def match_telemetry(telemetry, forecast_dates):
             forecast_dates[ids_to_keep])
 
 
+def _window_bounds(index, dates, half_width=pd.Timedelta('30min')):
+    """Return slice bounds of sorted index within half_width of each date.
+
+    Entries index[left[i]:right[i]] are those strictly less than half_width
+    away from dates[i].
+    """
+    left = index.searchsorted(dates - half_width, side='right')
+    right = index.searchsorted(dates + half_width, side='left')
+    return left, right
+
+
+def _window_medians(series, left, right):
+    """Return medians of series values in each slice [left[i], right[i]).
+
+    All slices must be non-empty. As for np.median, slices containing NaN
+    have a NaN median.
+    """
+    counts = right - left
+    # gather the samples of all slices end to end, labelled by slice number
+    slice_id = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    samples = series.to_numpy()[np.repeat(left, counts) + offsets]
+    medians = pd.Series(samples).groupby(slice_id).median().to_numpy()
+
+    # groupby skips NaN, so put them back
+    has_nan = np.bincount(slice_id, weights=np.isnan(samples),
+                          minlength=len(counts)) > 0
+    medians[has_nan] = np.nan
+    return medians
+
+
 def interpolate(x, y, new_x, ddz=True, s=0):
     """Interpolate 1D array y at values x to new_x values.
 
@@ -287,7 +363,7 @@ def interpolate(x, y, new_x, ddz=True, s=0):
 
     """
     # this is a smoothing spline unless s=0
-    f_y = UnivariateSpline(x, y, s=s)
+    f_y = _make_spline(x, y, s=s)
 
     if ddz:
         dfydz = f_y.derivative()
@@ -296,6 +372,19 @@ def interpolate(x, y, new_x, ddz=True, s=0):
         return f_y(new_x)
 
 
+def _make_spline(x, y, s=0):
+    """Return a cubic spline of y(x); interpolating if s=0, else smoothing.
+
+    For s=0 and finite y, CubicSpline's not-a-knot interpolant matches
+    UnivariateSpline(x, y, s=0) to rounding, and is faster to construct.
+    CubicSpline rejects non-finite y, so those keep using UnivariateSpline,
+    which evaluates to NaN.
+    """
+    if s == 0 and np.all(np.isfinite(y)):
+        return CubicSpline(x, y)
+    return UnivariateSpline(x, y, s=s)
+
+
 def osborn(inputs):
     """Calculate Cn2 model from Osborn et al 2018.
 
@@ -317,16 +406,22 @@ def osborn(inputs):
     # theta and d/dz(theta)
     thetaz, dthetaz = osborn_theta(inputs)
 
-    # wind shear => caclulate L(h)
-    windshear = inputs['dudz']**2 + inputs['dvdz']**2
+    # wind shear => caclulate L(h)**2, in place on a single array
+    lz2 = inputs['dudz']**2 + inputs['dvdz']**2
+    lz2 *= 2 / g
+    lz2 *= thetaz
     # Absolute value to smooth the occasional numerical issue which causes a 
     # negative Theta'(z) -- in the FA regime, it should always be positive.
-    lz = np.sqrt(2*thetaz / g * windshear / abs(dthetaz))
+    lz2 /= abs(dthetaz)
 
-    numerator = 80e-6 * inputs['p'] * dthetaz
-    denominator = inputs['t'] * thetaz
+    # (80e-6 * P(z) * Theta'(z) / (T(z) * Theta(z)))**2, also in place
+    ratio = 80e-6 * inputs['p'] * dthetaz
+    ratio /= inputs['t']
+    ratio /= thetaz
+    ratio *= ratio
 
-    return lz**(4/3) * (numerator / denominator)**2
+    # L(z)**(4/3) = (L(z)**2)**(2/3)
+    return lz2**(2/3) * ratio
 
 
 def osborn_theta(inputs):
@@ -342,9 +437,9 @@ def osborn_theta(inputs):
     Rcp = 0.286
     P0 = 1000 * 100  # mbar to Pa
 
-    theta = inputs['t'] * (P0 / inputs['p'])**Rcp
-
     amp = (P0/inputs['p'])**Rcp
+    theta = inputs['t'] * amp
+
     p_ratio = inputs['dpdz'] / inputs['p']
     dthetaz = amp * (inputs['dtdz'] - Rcp * inputs['t'] * p_ratio)
 
@@ -368,39 +463,48 @@ def integrate_in_bins(cn2, h, edges):
     # make an equally spaced sampling in h across whole range:
     h_samples = np.linspace(edges[0], edges[-1], 1000)
 
-    J = []
-    for i in range(len(edges)-1):
-        # find the h samples that are within the altitude range of integration
-        h_i = h_samples[(h_samples < edges[i+1]) &
-                        (h_samples > edges[i])]
-        # get Cn2 interpolation at those values of h -- s=0 for no smoothing.
-        cn2_i = np.exp(interpolate(h, np.log(cn2), h_i, ddz=False, s=0))
-        # numerically integrate to find the J value for this bin
-        J.append(trapz(cn2_i, h_i))
-    
+    # Cn2 interpolation, fit once for all bins -- s=0 for no smoothing.
+    f_log_cn2 = _make_spline(h, np.log(cn2), s=0)
+
+    cn2_samples = np.exp(f_log_cn2(h_samples))
+
+    # each bin is integrated over the h samples strictly within its edges, ie
+    # from sample index first to last (no integral if fewer than 2 samples)
+    # (a lower edge at the top sample would otherwise index past the end)
+    first = np.searchsorted(h_samples, edges[:-1], side='right')
+    first = np.minimum(first, len(h_samples) - 1)
+    last = np.searchsorted(h_samples, edges[1:], side='left') - 1
+    last = np.maximum(first, last)
+
+    # samples are equally spaced, so the trapezoid rule is dx times the sum of
+    # the samples in each bin, less half of the two end samples. Each bin is
+    # summed separately (even entries of the reduceat over [first, last+1]
+    # pairs), so small upper bins don't lose precision to the lower ones.
+    dx = h_samples[1] - h_samples[0]
+    has_area = last > first
+    bounds = np.ravel([first[has_area], last[has_area] + 1], order='F')
+    bin_sums = np.add.reduceat(np.append(cn2_samples, 0), bounds)[::2]
+
+    J = np.zeros(len(first))
+    J[has_area] = dx * (bin_sums - 0.5 * (cn2_samples[first[has_area]] +
+                                          cn2_samples[last[has_area]]))
+
     # The dh we integrated over was in km, rather than m. Convert that now, so
     # that J has units of m**(1/3) as desired
-    J = np.array(J) * 1000
+    J = J * 1000
 
     return J
 
 
 def smooth_dir(directions):
     """Return "smoothed" dirs by shifting points +/- 360 for smooth curve."""
-    smooth_dir = np.zeros(directions.shape)
-    smooth_dir[0] = directions[0]
-
-    for i in range(smooth_dir.shape[0]-1):
-        # make an array of options: next pt, next pt+360, next pt-360
-        options = directions[i+1] + np.array([720, 360, 0, -360, -720])
-        # find the option for next that has smallest jump from the current
-        smoothest = np.argmin(abs(options - smooth_dir[i]))
-        smooth_dir[i+1] = options[smoothest]
+    # shift each point by the multiple of 360 which brings it closest to the
+    # previous (shifted) point, i.e. keep every jump within (-180, 180]
+    shifts = -360 * np.ceil((np.diff(directions) - 180) / 360)
+    smooth_dir = np.array(directions, dtype=float)
+    smooth_dir[1:] += np.cumsum(shifts)
 
     # check the mean of the directions, bring up/down by 360 if needed
-    while smooth_dir.mean() > 180:
-        smooth_dir -= 360
-    while smooth_dir.mean() < -180:
-        smooth_dir += 360
+    smooth_dir -= 360 * np.round(smooth_dir.mean() / 360)
 
     return smooth_dir
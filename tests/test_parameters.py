@@ -55,6 +55,13 @@ def test_init():
     np.testing.assert_allclose(theta_test, theta_true, atol=.0001,
                                err_msg='Error in wind direction conversion!')
 
+    # same, writing into a preallocated output array
+    out = np.empty(len(u))
+    theta_out = psfws.utils.to_direction(u, v, out=out)
+    assert theta_out is out, 'to_direction did not return out array!'
+    np.testing.assert_allclose(out, theta_true, atol=.0001,
+                               err_msg='Error in wind direction conversion!')
+
 
 def test_params():
     """Unit tests to check the parameter outputs."""
@@ -112,6 +119,83 @@ def test_interp():
                                err_msg='Error in interpolation derivative!')
 
 
+def test_smooth_dir():
+    """Unit tests of unwrapping wind directions."""
+    # jumps across north are unwrapped, then the mean brought into +/-180
+    np.testing.assert_allclose(psfws.utils.smooth_dir(np.array([350., 10., 30.])),
+                               [-10., 10., 30.])
+    np.testing.assert_allclose(psfws.utils.smooth_dir(np.array([10., 350., 330.])),
+                               [10., -10., -30.])
+    # no jumps, only recentering of the mean
+    np.testing.assert_allclose(psfws.utils.smooth_dir(np.array([200., 210., 220.])),
+                               [-160., -150., -140.])
+    # steady +170 degree steps wrap around several times
+    dirs = np.array([0., 170., 340., 150., 320., 130., 300., 110.])
+    np.testing.assert_allclose(psfws.utils.smooth_dir(dirs),
+                               np.arange(8) * 170. - 720.)
+
+
+def test_process_forecast():
+    """Unit tests of forecast processing."""
+    dates = pd.DatetimeIndex(['2019-05-01 00:00', '2019-05-01 12:00'],
+                             tz='UTC')
+    df = pd.DataFrame({'u': [np.array([3., 0.]), np.array([1., 1.])],
+                       'v': [np.array([4., -2.]), np.array([1., 1.])],
+                       't': [np.array([250., 280.]), np.array([1., 1.])],
+                       'p': [np.array([1., 2.]), np.array([1., 2.])]},
+                      index=dates)
+    out = psfws.utils.process_forecast(df)
+
+    # daytime forecast and pressures dropped, profiles reversed
+    np.testing.assert_array_equal(out.index, dates[:1])
+    assert set(out.columns) == set(['u', 'v', 't', 'speed', 'phi'])
+    np.testing.assert_allclose(out.at[dates[0], 'u'], [0., 3.])
+    np.testing.assert_allclose(out.at[dates[0], 't'], [280., 250.])
+    np.testing.assert_allclose(out.at[dates[0], 'speed'], [2., 5.])
+    np.testing.assert_allclose(out.at[dates[0], 'phi'],
+                               psfws.utils.to_direction([0., 3.], [-2., 4.]))
+
+    # with only daytime forecasts, output is empty but has all columns
+    out = psfws.utils.process_forecast(df.iloc[1:])
+    assert len(out) == 0
+    assert set(out.columns) == set(['u', 'v', 't', 'speed', 'phi'])
+
+
+def test_match_telemetry():
+    """Unit tests of matching telemetry to forecast dates."""
+    f0 = pd.Timestamp('2019-05-01 00:00', tz='UTC')
+    forecast_dates = pd.DatetimeIndex([f0, f0 + pd.Timedelta('6h'),
+                                       f0 + pd.Timedelta('12h')])
+    # unsorted telemetry; samples at exactly +/-30min are outside the window,
+    # and there are no speeds near the second forecast
+    offsets = ['11h50min', '-10min', '30min', '12h40min', '20min', '-30min',
+               '12h10min', '5h40min']
+    index = pd.DatetimeIndex([f0 + pd.Timedelta(o) for o in offsets])
+    telemetry = {'speed': pd.Series([7., 2., 100., 100., 4., 100., 9., 100.],
+                                    index=index),
+                 'phi': pd.Series([350., 10., 0., 0., 20., 0., 340., 90.],
+                                  index=index),
+                 't': pd.Series([280., 270., 0., 0., 274., 0., 281., 290.],
+                                index=index)}
+    # the speed at 5h40min (for the second forecast) is masked out
+    telemetry['speed'] = telemetry['speed'].drop(f0 + pd.Timedelta('5h40min'))
+
+    matched, dates = psfws.utils.match_telemetry(telemetry, forecast_dates)
+
+    np.testing.assert_array_equal(dates, forecast_dates[[0, 2]],
+                                  err_msg='Error in matched telemetry dates!')
+    np.testing.assert_allclose(matched['speed'], [3., 8.])
+    np.testing.assert_allclose(matched['phi'], [15., 345.])
+    np.testing.assert_allclose(matched['t'], [272., 280.5])
+    np.testing.assert_allclose(np.hypot(matched['u'], matched['v']),
+                               matched['speed'])
+
+    # as for np.median, a NaN sample in a window gives a NaN median
+    telemetry['t'].iloc[0] = np.nan
+    matched, dates = psfws.utils.match_telemetry(telemetry, forecast_dates)
+    np.testing.assert_allclose(matched['t'], [272., np.nan])
+
+
 def test_coords():
     """Unit tests to check changing to GalSim coordinates."""
     # edge case: when at zenith, components for sky and earth are equal.
@@ -156,5 +240,8 @@ if __name__ == '__main__':
     test_init()
     test_params()
     test_interp()
+    test_smooth_dir()
+    test_process_forecast()
+    test_match_telemetry()
     test_coords()
     test_zenith()
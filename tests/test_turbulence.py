@@ -62,6 +62,37 @@ def test_turbulence_integration():
     np.testing.assert_allclose(j_analytic, j_utils, atol=1e-10, rtol=1e-3,
                                err_msg='error integration cn2')
 
+    # zero width bins, including one at the top edge, should integrate to 0
+    j_split = psfws.utils.integrate_in_bins(cn2_m, h_km, [x0, 10, x1])
+    j_degen = psfws.utils.integrate_in_bins(cn2_m, h_km, [x0, 10, x1, x1])
+    np.testing.assert_allclose(j_degen, np.append(j_split, 0), rtol=1e-12,
+                               err_msg='error integrating zero width bins')
+    j_degen = psfws.utils.integrate_in_bins(cn2_m, h_km, [x0, x1, x1])
+    np.testing.assert_allclose(j_degen, np.append(j_utils, 0), rtol=1e-12,
+                               err_msg='error integrating zero width bins')
+
+    # steeply falling Cn2: upper bins must keep full precision, compare to
+    # trapezoid rule over the samples strictly inside each bin
+    cn2_steep = np.exp(-3 * h_km) * 1e-14
+    edges = np.linspace(x0, x1, 9)
+    j_steep = psfws.utils.integrate_in_bins(cn2_steep, h_km, edges)
+    h_s = np.linspace(x0, x1, 1000)
+    f_s = np.exp(np.interp(h_s, h_km, np.log(cn2_steep)))
+    j_trap = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        inside = (h_s > lo) & (h_s < hi)
+        x, y = h_s[inside], f_s[inside]
+        j_trap.append(np.sum(0.5 * (y[1:] + y[:-1]) * np.diff(x)) * 1000)
+    np.testing.assert_allclose(j_steep, j_trap, rtol=1e-9,
+                               err_msg='error integrating steep cn2')
+
+    # a zero in Cn2 (log is -inf) gives NaN integrals rather than an error
+    cn2_zero = cn2_m.copy()
+    cn2_zero[100] = 0
+    with np.errstate(divide='ignore'):
+        j_zero = psfws.utils.integrate_in_bins(cn2_zero, h_km, [x0, 10, x1])
+    assert np.all(np.isnan(j_zero)), 'error integrating cn2 with zeros'
+
     # test sum FA weights = j integral
     p = psfws.ParameterGenerator(seed=25493867)
     pt = p.draw_datapoint()